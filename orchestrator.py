@@ -6,60 +6,159 @@ One student per session
 Context memory + invigilation ready
 """
 
-import socket, time, queue, threading, json, requests, re
+import socket, select, time, queue, threading, requests, re, struct
 import numpy as np
+import orjson
+import torch
 from collections import deque
-from faster_whisper import WhisperModel
+from requests.adapters import HTTPAdapter
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+from silero_vad import load_silero_vad
 from TTS.api import TTS
 
 # ================= CONFIG =================
 SAMPLE_RATE = 16000
 BLOCK_SIZE = 1024
-BYTES_PER_SAMPLE = 4
+AUDIO_BATCH = 4             # mic blocks per audio_q entry
+AUDIO_POOL = 8
+PCM_SCALE = 1 / 32768       # the Pi sends int16 mic samples
 
 TCP_AUDIO_PORT = 50005
 TCP_CMD_PORT   = 50006
 TCP_TTS_PORT   = 50007
 
+KEEPALIVE_IDLE = 5          # seconds of silence before the first probe
+KEEPALIVE_INTVL = 2
+KEEPALIVE_CNT = 3
+
+# command frames: 2-byte big-endian length, then the JSON payload
+CMD_HDR = struct.Struct("!H")
+CMD_CONNECT_TIMEOUT = 2.0
+
 PI_IP = "10.185.164.130"
 
-WHISPER_MODEL = "medium.en"
+WHISPER_MODEL = "small.en"
+WHISPER_COMPUTE = "int8_float16"
+WHISPER_FLASH_ATTN = True   # falls back to standard attention if unsupported
+WHISPER_BATCH = 16
 DEVICE = "cuda"
 
 OLLAMA_URL = "http://10.185.164.137:11434/api/generate"
 OLLAMA_MODEL = "mistral:7b-instruct"
+OLLAMA_KEEP_ALIVE = "10m"
 
 SPEAKER_WAV = "speaker.wav"
+TTS_STREAM_CHUNK = 20
+
+# first byte of every TTS stream tells the Pi the sample format
+TTS_FMT_I16 = b"\x01"
 
 MIN_ENERGY = 0.03
+SQ_THRESHOLD = MIN_ENERGY ** 2 * BLOCK_SIZE     # MIN_ENERGY as a sum of squares
+VAD_THRESHOLD = 0.5
+VAD_WINDOW = 512            # Silero expects 512-sample windows at 16 kHz
 MIN_SPEECH_SEC = 0.7
 MAX_SPEECH_SEC = 4.0
 SILENT_FRAMES = 10
+START_WINDOW = 3            # recent blocks considered for speech onset
+START_VOICED = 2            # voiced blocks in the window needed to start
+VAD_BATCH = 8
 POST_TTS_COOLDOWN = 0.8
+COOLDOWN_BLOCKS = -(-int(POST_TTS_COOLDOWN * SAMPLE_RATE) // BLOCK_SIZE)
+MIN_SPEECH_LEN = int(MIN_SPEECH_SEC * SAMPLE_RATE)
+MAX_SPEECH_LEN = int(MAX_SPEECH_SEC * SAMPLE_RATE)
+MAX_SPEECH_SAMPLES = MAX_SPEECH_LEN + BLOCK_SIZE
+SPEECH_BUFFERS = 3
 
 VALID_ACTIONS = {"forward", "backward", "left", "right", "stop"}
 
+NAME_RE = re.compile(r"my name is (\w+)")
+WHATNAME_RE = re.compile(r"what is my name")
+REPEATQ_RE = re.compile(r"repeat the question")
+
 # ================= INIT =================
 print("🧠 Loading Whisper...")
-whisper = WhisperModel(WHISPER_MODEL, device=DEVICE, compute_type="float16")
+try:
+    whisper_model = WhisperModel(
+        WHISPER_MODEL, device=DEVICE, compute_type=WHISPER_COMPUTE,
+        flash_attention=WHISPER_FLASH_ATTN
+    )
+except Exception as e:
+    if not WHISPER_FLASH_ATTN:
+        raise
+    print("⚠️ Flash attention unavailable, loading without it:", e)
+    whisper_model = WhisperModel(
+        WHISPER_MODEL, device=DEVICE, compute_type=WHISPER_COMPUTE
+    )
+whisper = BatchedInferencePipeline(model=whisper_model)
+# one throwaway pass so CUDA/cuBLAS init and kernel selection happen now, not
+# on the first utterance; the plain model skips the VAD that would drop silence
+list(whisper.model.transcribe(
+    np.zeros(SAMPLE_RATE, dtype=np.float32), language="en", beam_size=1
+)[0])
+
+print("🗣️ Loading Silero VAD...")
+vad = load_silero_vad()
 
 print("🔊 Loading XTTS...")
 tts = TTS(
     model_name="tts_models/multilingual/multi-dataset/xtts_v2",
     progress_bar=False
 ).to("cuda")
+xtts = tts.synthesizer.tts_model
+gpt_cond_latent, speaker_embedding = xtts.get_conditioning_latents(
+    audio_path=[SPEAKER_WAV]
+)
 print("🔊 XTTS ready")
 
-audio_q = queue.Queue(maxsize=300)
+# single producer (audio_server), single consumer (main): deque append/popleft
+# need no lock, and the event only wakes main when it has drained everything
+audio_q = deque(maxlen=300 // AUDIO_BATCH)
+audio_ready = threading.Event()
+
+# audio_server receives straight into these; audio_frames hands them back
+block_pool = deque(
+    np.empty(AUDIO_BATCH * BLOCK_SIZE, dtype=np.int16) for _ in range(AUDIO_POOL)
+)
+utter_q = queue.Queue()
+text_q = queue.Queue()
 tts_q = queue.Queue()
 
+# recycled utterance buffers: main fills one while stt_worker transcribes another
+speech_pool = queue.Queue()
+for _ in range(SPEECH_BUFFERS):
+    speech_pool.put(np.empty(MAX_SPEECH_SAMPLES, dtype=np.float32))
+
 tts_stop = threading.Event()
 tts_playing = threading.Event()
 last_tts_time = 0.0
 
+cmd_sock = None
+cmd_lock = threading.Lock()
+
+# keep-alive pool so each LLM call reuses the TCP connection to Ollama
+http_session = requests.Session()
+http_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
 # ================= MEMORY =================
+class ConversationBuffer:
+    """Recent turns plus their rendered prompt text, updated on each append."""
+
+    def __init__(self, maxlen):
+        self.turns = deque(maxlen=maxlen)
+        self._lens = deque()
+        self.ctx_str = ""
 
-conversation_buffer = deque(maxlen=10)
+    def append(self, msg):
+        line = f"{msg['role']}: {msg['text']}"
+        if len(self.turns) == self.turns.maxlen:
+            # drop the oldest line and the newline after it
+            self.ctx_str = self.ctx_str[self._lens.popleft() + 1:]
+        self.turns.append(msg)
+        self._lens.append(len(line))
+        self.ctx_str = f"{self.ctx_str}\n{line}" if self.ctx_str else line
+
+conversation_buffer = ConversationBuffer(maxlen=10)
 
 session = {
     "mode": "chat",          # chat | test
@@ -75,39 +174,97 @@ session = {
 }
 
 # ================= UTILS =================
-def rms(x):
-    return float(np.sqrt(np.mean(x * x)))
-
 def speak(text):
     if text:
         tts_q.put(text)
         conversation_buffer.append({"role": "assistant", "text": text})
 
+def connect_cmd():
+    # bounded: this runs under cmd_lock, and an unreachable Pi would
+    # otherwise stall the dialog for the kernel's SYN timeout
+    s = socket.create_connection(
+        (PI_IP, TCP_CMD_PORT), timeout=CMD_CONNECT_TIMEOUT
+    )
+    s.settimeout(None)
+    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    # a rebooted Pi answers the probes with RST, which cmd_link_dead sees
+    keepalive(s)
+    return s
+
+def cmd_link_dead(s):
+    # the Pi never writes on this link, so anything readable is EOF or RST;
+    # without this check a command sent after a Pi restart is silently lost
+    if not select.select([s], [], [], 0)[0]:
+        return False
+    try:
+        return s.recv(1, socket.MSG_PEEK) == b""
+    except OSError:
+        return True
+
 def send_cmd(action):
-    payload = {"mode": "manual", "action": action}
-    with socket.socket() as s:
-        s.connect((PI_IP, TCP_CMD_PORT))
-        s.sendall((json.dumps(payload) + "\n").encode())
-    print("⚡ CMD:", action)
+    global cmd_sock
+    body = orjson.dumps({"mode": "manual", "action": action})
+    payload = CMD_HDR.pack(len(body)) + body
+    with cmd_lock:
+        # one reconnect attempt if the Pi dropped the persistent link
+        for attempt in range(2):
+            try:
+                if cmd_sock is not None and cmd_link_dead(cmd_sock):
+                    cmd_sock.close()
+                    cmd_sock = None
+                if cmd_sock is None:
+                    cmd_sock = connect_cmd()
+                cmd_sock.sendall(payload)
+                print("⚡ CMD:", action)
+                return
+            except OSError as e:
+                if cmd_sock is not None:
+                    cmd_sock.close()
+                    cmd_sock = None
+                if attempt:
+                    print("❌ CMD error:", e)
 
 # ================= AUDIO =================
+def keepalive(sock):
+    """Probe idle links so a Pi that vanished without a FIN is noticed in ~11 s."""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "TCP_KEEPIDLE"):     # Linux-only knobs
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEPALIVE_INTVL)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_CNT)
+
+def recv_into_exact(conn, mv):
+    got = 0
+    while got < len(mv):
+        n = conn.recv_into(mv[got:])
+        if not n:
+            return False
+        got += n
+    return True
+
 def audio_server():
-    sock = socket.socket()
-    sock.bind(("0.0.0.0", TCP_AUDIO_PORT))
-    sock.listen(1)
-    conn, _ = sock.accept()
+    # serves one Pi connection; supervise() calls it again after a disconnect
+    with socket.socket() as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("0.0.0.0", TCP_AUDIO_PORT))
+        sock.listen(1)
+        conn, _ = sock.accept()
+    # the laptop never writes here, so probes reach a Pi that rebooted or
+    # dropped off Wi-Fi and recv fails instead of blocking forever
+    keepalive(conn)
     print("🎤 Pi audio connected")
 
-    buf = b""
-    while True:
-        d = conn.recv(4096)
-        if not d:
-            break
-        buf += d
-        while len(buf) >= BLOCK_SIZE * BYTES_PER_SAMPLE:
-            chunk = buf[:BLOCK_SIZE * BYTES_PER_SAMPLE]
-            buf = buf[BLOCK_SIZE * BYTES_PER_SAMPLE:]
-            audio_q.put(np.frombuffer(chunk, dtype=np.float32))
+    with conn:
+        while True:
+            # an entry dropped by the full deque never comes back; replace it
+            a = block_pool.popleft() if block_pool else np.empty(
+                AUDIO_BATCH * BLOCK_SIZE, dtype=np.int16
+            )
+            if not recv_into_exact(conn, memoryview(a).cast("B")):
+                break
+            audio_q.append(a)
+            audio_ready.set()
+    print("🎤 Pi audio disconnected")
 
 # ================= TTS =================
 def tts_worker():
@@ -124,15 +281,19 @@ def tts_worker():
             sock = socket.socket()
             sock.connect((PI_IP, TCP_TTS_PORT))
 
-            sock.sendall(np.zeros(2400, dtype=np.float32).tobytes())
+            sock.sendall(TTS_FMT_I16)
 
-            wav = tts.tts(text=text, language="en", speaker_wav=SPEAKER_WAV)
-            wav = np.asarray(wav, dtype=np.float32)
-
-            for i in range(0, len(wav), 1024):
+            # send int16 PCM chunk by chunk while XTTS is still generating
+            for chunk in xtts.inference_stream(
+                text, "en", gpt_cond_latent, speaker_embedding,
+                stream_chunk_size=TTS_STREAM_CHUNK,
+                enable_text_splitting=True      # as tts.tts() did for long replies
+            ):
                 if tts_stop.is_set():
                     break
-                sock.sendall(wav[i:i+1024].tobytes())
+                wav = chunk.cpu().numpy()
+                pcm16 = np.clip(wav * 32767, -32768, 32767).astype(np.int16)
+                sock.sendall(memoryview(pcm16).cast("B"))
 
             sock.close()
         except Exception as e:
@@ -142,129 +303,269 @@ def tts_worker():
         last_tts_time = time.time()
 
 # ================= LLM =================
-def call_llm(text):
-    context = "\n".join(
-        f"{m['role']}: {m['text']}" for m in conversation_buffer
-    )
+# Fixed text goes first so Ollama can reuse its KV cache for this prefix
+# and only prefill the facts and conversation that follow.
+PROMPT_PREFIX = (
+    "You are a communication companion.\n"
+    "Respond briefly.\n"
+    "Return ONLY valid JSON:\n"
+    "{\"speech\":\"<reply>\","
+    "\"command\":{\"action\":\"forward|backward|left|right|stop|turn|null\",\"direction\":\"left|right|null\"}}\n\n"
+)
 
+def call_llm(text):
     prompt = (
-        "You are a communication companion.\n"
-        "Respond briefly.\n\n"
-        f"Known facts:\nUser name: {session['user']['name']}\n\n"
-        f"Recent conversation:\n{context}\n\n"
-        f"User: {text}\n\n"
-        "Return ONLY valid JSON:\n"
-        "{\"speech\":\"<reply>\","
-        "\"command\":{\"action\":\"forward|backward|left|right|stop|turn|null\",\"direction\":\"left|right|null\"}}"
+        PROMPT_PREFIX
+        + f"Known facts:\nUser name: {session['user']['name']}\n\n"
+        + f"Recent conversation:\n{conversation_buffer.ctx_str}\n\n"
+        + f"User: {text}\n"
     )
 
-    r = requests.post(
+    r = http_session.post(
         OLLAMA_URL,
-        json={
+        data=orjson.dumps({
             "model": OLLAMA_MODEL,
             "prompt": prompt,
             "format": "json",
-            "stream": False,
-            "temperature": 0.1
-        },
+            "stream": True,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "options": {"num_predict": 128, "temperature": 0.1}
+        }),
+        headers={"Content-Type": "application/json"},
+        stream=True,
         timeout=15
     )
 
-    data = r.json()
-    resp = data.get("response")
-    return resp if isinstance(resp, dict) else json.loads(resp)
-
-# ================= MAIN =================
-def main():
-    buf = []
-    silent = 0
-    speaking = False
-    t0 = 0
+    # Track brace depth over the streamed fragments and hang up as soon as
+    # the top-level object closes; Ollama stops generating on disconnect.
+    reply = ""
+    depth = 0
+    in_str = escaped = False
+    try:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if not line:
+                continue
+            frag = orjson.loads(line).get("response", "")
+            for ch in frag:
+                reply += ch
+                if in_str:
+                    if escaped:
+                        escaped = False
+                    elif ch == "\\":
+                        escaped = True
+                    elif ch == '"':
+                        in_str = False
+                elif ch == '"':
+                    in_str = True
+                elif ch == "{":
+                    depth += 1
+                elif ch == "}":
+                    depth -= 1
+                    if depth == 0:
+                        return orjson.loads(reply)
+        return orjson.loads(reply)
+    finally:
+        r.close()
+
+# ================= STT =================
+def stt_worker():
+    while True:
+        buf, n = utter_q.get()
+        try:
+            # Silero VAD inside faster-whisper trims the silent tail and splits
+            # the speech into chunks the encoder runs as one batch
+            segments, _ = whisper.transcribe(
+                buf[:n], language="en", batch_size=WHISPER_BATCH,
+                vad_filter=True, vad_parameters=dict(min_silence_duration_ms=300),
+                beam_size=1, without_timestamps=True
+            )
+            text = " ".join(s.text for s in segments).strip()
+        except Exception as e:
+            print("❌ STT error:", e)
+            text = ""
+        finally:
+            speech_pool.put(buf)
 
-    print("🎧 Listening (Session-aware)...")
+        if text:
+            text_q.put(text)
 
+# ================= DIALOG =================
+def dialog_worker():
+    # separate stage so Whisper can run on the next utterance during the LLM call
     while True:
-        a = audio_q.get()
+        handle_text(text_q.get())
+
+def handle_text(text):
+    print("📝 USER:", text)
+    conversation_buffer.append({"role": "user", "text": text})
+
+    # ---------- MEMORY RULES ----------
+    text_low = text.lower()
+    name_match = NAME_RE.search(text_low)
+    if name_match:
+        session["user"]["name"] = name_match.group(1).capitalize()
+        speak(f"Nice to meet you, {session['user']['name']}.")
+        return
+
+    if WHATNAME_RE.search(text_low) and session["user"]["name"]:
+        speak(f"Your name is {session['user']['name']}.")
+        return
+
+    if REPEATQ_RE.search(text_low):
+        q = session["test"]["current_question"]
+        if q:
+            speak(q)
+        else:
+            speak("I haven't asked a question yet.")
+        return
 
-        if time.time() - last_tts_time < POST_TTS_COOLDOWN:
-            continue
+    # ---------- LLM ----------
+    try:
+        out = call_llm(text)
+    except Exception as e:
+        print("❌ LLM error:", e)
+        speak("Sorry, please repeat.")
+        return
 
-        e = rms(a)
+    print("🧠 JSON:", out)
 
-        if not speaking:
-            if e > MIN_ENERGY:
-                buf = [a]
-                t0 = time.time()
-                speaking = True
-                silent = 0
-                if tts_playing.is_set():
-                    tts_stop.set()
-        else:
-            buf.append(a)
-            silent = silent + 1 if e < MIN_ENERGY else 0
+    speech = out.get("speech", "")
+    cmd = out.get("command", {})
 
-            dur = time.time() - t0
-            if silent >= SILENT_FRAMES or dur > MAX_SPEECH_SEC:
-                speaking = False
-                if dur < MIN_SPEECH_SEC:
-                    continue
+    speak(speech)
 
-                audio = np.concatenate(buf)
-                segments, _ = whisper.transcribe(audio, language="en")
-                text = " ".join(s.text for s in segments).strip()
+    action = cmd.get("action")
 
-                if not text:
-                    continue
+    if action == "turn":
+        direction = cmd.get("direction")
+        if direction in ("left", "right"):
+            send_cmd(direction)
 
-                print("📝 USER:", text)
-                conversation_buffer.append({"role": "user", "text": text})
+    elif action in VALID_ACTIONS:
+        send_cmd(action)
 
-                # ---------- MEMORY RULES ----------
-                name_match = re.search(r"my name is (\w+)", text.lower())
-                if name_match:
-                    session["user"]["name"] = name_match.group(1).capitalize()
-                    speak(f"Nice to meet you, {session['user']['name']}.")
-                    continue
+# ================= MAIN =================
+def next_audio():
+    while not audio_q:
+        audio_ready.wait()
+        audio_ready.clear()
+    return audio_q.popleft()
+
+def audio_frames():
+    """Yield (block, sum of squares), scoring up to VAD_BATCH queued blocks at once."""
+    while True:
+        chunks = [next_audio()]
+        while audio_q and len(chunks) * AUDIO_BATCH < VAD_BATCH:
+            chunks.append(audio_q.popleft())
+        arr = np.multiply(
+            np.concatenate(chunks), PCM_SCALE, dtype=np.float32
+        ).reshape(-1, BLOCK_SIZE)
+        block_pool.extend(chunks)
+        yield from zip(arr, np.einsum("ij,ij->i", arr, arr))
+
+def speech_prob(block):
+    """Highest Silero speech probability across the block's VAD windows."""
+    with torch.no_grad():
+        frames = torch.from_numpy(block).view(-1, VAD_WINDOW)
+        return max(vad(f, SAMPLE_RATE).item() for f in frames)
+
+def is_voiced(block, sos):
+    # the energy gate keeps Silero off pure silence; Silero rejects fans and HVAC
+    return sos > SQ_THRESHOLD and speech_prob(block) > VAD_THRESHOLD
 
-                if "what is my name" in text.lower() and session["user"]["name"]:
-                    speak(f"Your name is {session['user']['name']}.")
-                    continue
+def main():
+    speech_buf = None
+    write_idx = 0
+    silent = 0
+    speaking = False
 
-                if "repeat the question" in text.lower():
-                    q = session["test"]["current_question"]
-                    if q:
-                        speak(q)
-                    else:
-                        speak("I haven't asked a question yet.")
-                    continue
+    # onset window: the last START_WINDOW idle blocks and their VAD verdicts,
+    # so one transient can't start a recording and the onset isn't clipped
+    recent = np.zeros((START_WINDOW, BLOCK_SIZE), dtype=np.float32)
+    voiced = np.zeros(START_WINDOW, dtype=bool)
+    n_idle = 0
 
-                # ---------- LLM ----------
-                try:
-                    out = call_llm(text)
-                except Exception as e:
-                    print("❌ LLM error:", e)
-                    speak("Sorry, please repeat.")
-                    continue
+    # the cooldown is counted in blocks from the moment TTS is seen to end
+    seen_tts = last_tts_time
+    cooldown = 0
 
-                print("🧠 JSON:", out)
+    # Silero carries state between calls; while idle it only sees blocks
+    # above the energy gate, so reset it at every gap instead of letting
+    # context from seconds ago sway the onset decision
+    vad_fresh = True
 
-                speech = out.get("speech", "")
-                cmd = out.get("command", {})
+    print("🎧 Listening (Session-aware)...")
 
-                speak(speech)
+    for a, sos in audio_frames():
+        if last_tts_time != seen_tts:
+            seen_tts = last_tts_time
+            cooldown = COOLDOWN_BLOCKS
+            vad.reset_states()
+            vad_fresh = True
+        if cooldown:
+            cooldown -= 1
+            voiced[:] = False
+            n_idle = 0
+            continue
 
-                action = cmd.get("action")
+        if not speaking:
+            slot = n_idle % START_WINDOW
+            recent[slot] = a
+            voiced[slot] = is_voiced(a, sos)
+            n_idle += 1
+            if sos > SQ_THRESHOLD:
+                vad_fresh = False
+            elif not vad_fresh:
+                vad.reset_states()
+                vad_fresh = True
+
+            if voiced.sum() >= START_VOICED:
+                try:
+                    speech_buf = speech_pool.get_nowait()
+                except queue.Empty:
+                    # every buffer is still queued for STT; let this one pass
+                    continue
+                # copy only blocks captured since the window was last cleared
+                write_idx = 0
+                for k in range(max(0, n_idle - START_WINDOW), n_idle):
+                    speech_buf[write_idx:write_idx + BLOCK_SIZE] = recent[k % START_WINDOW]
+                    write_idx += BLOCK_SIZE
+                speaking = True
+                silent = 0
+                if tts_playing.is_set():
+                    tts_stop.set()
+        else:
+            # durations are counted in samples, not wall-clock time
+            speech_buf[write_idx:write_idx + len(a)] = a
+            write_idx += len(a)
+            silent = 0 if is_voiced(a, sos) else silent + 1
 
-                if action == "turn":
-                    direction = cmd.get("direction")
-                    if direction in ("left", "right"):
-                        send_cmd(direction)
+            if silent >= SILENT_FRAMES or write_idx >= MAX_SPEECH_LEN:
+                speaking = False
+                vad.reset_states()
+                vad_fresh = True
+                voiced[:] = False
+                n_idle = 0
+                # judge length on the voiced span, not the onset or silent tail
+                if write_idx - silent * BLOCK_SIZE < MIN_SPEECH_LEN:
+                    speech_pool.put(speech_buf)
+                    continue
 
-                elif action in VALID_ACTIONS:
-                    send_cmd(action)
+                # hand off and keep listening while STT + LLM run
+                utter_q.put((speech_buf, write_idx))
 
 # ================= START =================
+def supervise(target):
+    """Keep a worker alive: rerun it whenever it returns or raises."""
+    while True:
+        try:
+            target()
+        except Exception as e:
+            print(f"♻️ {target.__name__} crashed:", e)
+        time.sleep(1.0)
+
 if __name__ == "__main__":
-    threading.Thread(target=audio_server, daemon=True).start()
-    threading.Thread(target=tts_worker, daemon=True).start()
+    for worker in (audio_server, tts_worker, stt_worker, dialog_worker):
+        threading.Thread(target=supervise, args=(worker,), daemon=True).start()
     main()
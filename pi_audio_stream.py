@@ -6,15 +6,21 @@ Raspberry Pi Bridge FINAL (MATCHED WITH ORCHESTRATOR)
 Mic  -> TCP audio -> Laptop
 Laptop -> TCP command -> USB serial -> ESP32
 Laptop -> TCP TTS -> Speaker (stable, no clipping)
+
+All sockets are served from one selectors loop on the main thread.
 """
 
 import sounddevice as sd
+import selectors
 import socket
+import functools
 import threading
+import queue
+import os
+import struct
 import serial
-import numpy as np
 import time
-import json
+import orjson
 
 # ================= CONFIG =================
 MIC_SAMPLE_RATE = 16000
@@ -27,8 +33,34 @@ AUDIO_PORT = 50005
 CMD_PORT   = 50006
 TTS_PORT   = 50007
 
+MIC_RETRY_SEC = 2.0
+KEEPALIVE_IDLE = 5          # seconds of silence before the first probe
+KEEPALIVE_INTVL = 2
+KEEPALIVE_CNT = 3
+# the mic link always has unacked data, so keepalive never probes it; cap
+# how long sent data may stay unacknowledged instead
+MIC_USER_TIMEOUT_MS = (KEEPALIVE_IDLE + KEEPALIVE_INTVL * KEEPALIVE_CNT) * 1000
+MIC_DTYPE = "int16"         # half the bytes of float32; the laptop rescales
+MIC_BYTES_PER_SAMPLE = 2
+MIC_TX_BLOCKS = 4           # mic blocks per TCP send, matches the laptop's batch
+MIC_TX_BUFFERS = 4          # one filling + two queued + one on the wire
+TTS_MAX_PENDING = 16384     # bytes buffered ahead of the speaker
+TTS_PUMP_SEC = 0.01
+
+# first byte of every TTS stream names the sample format; the speaker
+# stream runs continuously at int16, so that is the only one accepted
+TTS_FMT_I16 = b"\x01"
+TTS_SAMPLE_BYTES = 2
+TTS_SILENCE = memoryview(bytes(BLOCK_SIZE * TTS_SAMPLE_BYTES))
+
+# each command is a 2-byte big-endian length followed by the JSON payload
+CMD_HDR = struct.Struct("!H")
+
 ESP32_PORT = "/dev/ttyUSB0"
 ESP32_BAUD = 115200
+ESP_QUEUE_MAX = 32
+
+sel = selectors.DefaultSelector()
 
 # ================= ESP32 SERIAL =================
 try:
@@ -39,102 +71,336 @@ except Exception as e:
     print("? ESP32 serial error:", e)
     esp32 = None
 
-# ================= MIC STREAM =================
-def mic_stream():
+esp_q = queue.Queue(maxsize=ESP_QUEUE_MAX)
+
+def esp_send(line):
+    try:
+        esp_q.put_nowait(line)
+    except queue.Full:
+        if line != b"stop\n":
+            print("? ESP32 queue full, dropped:", line.decode().strip())
+            return
+        # a stop must always get through; it supersedes everything queued.
+        # The writer may drain the queue concurrently, so only trust get_nowait
+        while True:
+            try:
+                esp_q.get_nowait()
+            except queue.Empty:
+                break
+        esp_q.put_nowait(line)
+
+def esp_writer():
+    # owns the UART so a slow write never stalls the socket loop
     while True:
+        line = esp_q.get()
+        # every line replaces the rover's current action, so of a backlog
+        # only the newest one still matters
+        while True:
+            try:
+                line = esp_q.get_nowait()
+            except queue.Empty:
+                break
         try:
-            sock = socket.socket()
-            sock.connect((LAPTOP_IP, AUDIO_PORT))
-            print("?? Mic connected to Laptop")
-
-            def callback(indata, frames, time_info, status):
-                try:
-                    sock.sendall(indata.astype(np.float32).tobytes())
-                except Exception:
-                    pass
-
-            with sd.InputStream(
-                samplerate=MIC_SAMPLE_RATE,
-                channels=1,
-                blocksize=BLOCK_SIZE,
-                dtype="float32",
-                callback=callback
-            ):
-                while True:
-                    time.sleep(1)
-
+            esp32.write(line)
+            print("? SENT TO ESP32:", line.decode().strip())
         except Exception as e:
-            print("?? Mic reconnecting:", e)
-            time.sleep(2)
+            print("? ESP32 write error:", e)
 
-# ================= COMMAND SERVER =================
-def command_server():
-    sock = socket.socket()
-    sock.bind(("0.0.0.0", CMD_PORT))
-    sock.listen(5)
-    print("?? Command server listening")
+# ================= MIC STREAM =================
+mic = {"sock": None, "stream": None, "retry_at": 0.0, "tx": None, "fill": 0}
+mic_tx_q = queue.Queue(maxsize=2)
+mic_free = queue.SimpleQueue()
+for _ in range(MIC_TX_BUFFERS):
+    mic_free.put(bytearray(MIC_TX_BLOCKS * BLOCK_SIZE * MIC_BYTES_PER_SAMPLE))
+
+def mic_callback(indata, frames, time_info, status):
+    # PortAudio thread: only copy into the current batch, never touch the socket
+    tx, fill = mic["tx"], mic["fill"]
+    tx[fill:fill + indata.nbytes] = memoryview(indata).cast("B")
+    fill += indata.nbytes
+    if fill == len(tx):
+        try:
+            mic_tx_q.put_nowait(tx)
+        except queue.Full:
+            pass    # sender is stalled: drop this batch and refill the buffer
+        else:
+            # cannot be empty: at most three buffers are queued or sending
+            mic["tx"] = mic_free.get_nowait()
+        fill = 0
+    mic["fill"] = fill
 
+def mic_sender():
     while True:
-        conn, addr = sock.accept()
+        tx = mic_tx_q.get()
+        sock = mic["sock"]
         try:
-            raw = conn.recv(1024).decode().strip()
-            if not raw:
-                continue
+            if sock is not None:
+                sock.sendall(tx)
+        except OSError:
+            pass    # the loop sees the reset on read and reconnects
+        finally:
+            mic_free.put(tx)
+
+def mic_connect():
+    sock = socket.socket()
+    keepalive(sock)
+    if hasattr(socket, "TCP_USER_TIMEOUT"):
+        # a stalled sendall then fails and the loop reconnects
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT,
+                        MIC_USER_TIMEOUT_MS)
+    sock.setblocking(False)
+    sock.connect_ex((LAPTOP_IP, AUDIO_PORT))
+    mic["sock"] = sock
+    sel.register(sock, selectors.EVENT_WRITE, mic_connected)
+
+def mic_connected(sock):
+    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+    if err:
+        mic_close(os.strerror(err))
+        return
+
+    # mic_sender owns all sends; the loop only watches for EOF
+    sock.setblocking(True)
+    sel.modify(sock, selectors.EVENT_READ, mic_readable)
+    print("?? Mic connected to Laptop")
+
+    # start on a batch boundary; audio queued for the old link is stale
+    while not mic_tx_q.empty():
+        mic_free.put(mic_tx_q.get_nowait())
+    mic["fill"] = 0
+
+    stream = None
+    try:
+        stream = sd.InputStream(
+            samplerate=MIC_SAMPLE_RATE,
+            channels=1,
+            blocksize=BLOCK_SIZE,
+            dtype=MIC_DTYPE,
+            callback=mic_callback
+        )
+        stream.start()
+    except Exception as e:
+        # e.g. USB mic not enumerated yet at boot: drop the link and retry
+        if stream is not None:
+            stream.close()
+        mic_close(e)
+        return
+    mic["stream"] = stream
+
+def mic_readable(sock):
+    try:
+        d = sock.recv(4096)
+    except OSError as e:
+        mic_close(e)
+        return
+    if not d:
+        mic_close("laptop closed the link")
+
+def mic_close(reason):
+    if mic["stream"] is not None:
+        mic["stream"].stop()
+        mic["stream"].close()
+        mic["stream"] = None
+    sel.unregister(mic["sock"])
+    mic["sock"].close()
+    mic["sock"] = None
+    mic["retry_at"] = time.monotonic() + MIC_RETRY_SEC
+    print("?? Mic reconnecting:", reason)
+
+# ================= COMMAND SERVER =================
+def dispatch(raw):
+    raw = raw.strip()
+    if not raw:
+        return
 
-            print("? CMD from Laptop:", raw)
+    print("? CMD from Laptop:", raw.decode(errors="replace"))
 
-            action = None
-            if raw.startswith("{"):
-                msg = json.loads(raw)
-                action = msg.get("action")
-            else:
-                action = raw
+    action = None
+    if raw.startswith(b"{"):
+        msg = orjson.loads(raw)
+        action = msg.get("action")
+    else:
+        action = raw.decode()
 
-            if action and esp32:
-                esp32.write((action.lower() + "\n").encode())
-                print("? SENT TO ESP32:", action)
+    if action and esp32:
+        esp_send((action.lower() + "\n").encode())
 
+def cmd_accept(srv):
+    conn, addr = srv.accept()
+    conn.setblocking(False)
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    print("?? Command link from", addr[0])
+    sel.register(conn, selectors.EVENT_READ,
+                 functools.partial(cmd_readable, {"buf": bytearray()}))
+
+cmd_rx = memoryview(bytearray(4096))
+
+def cmd_readable(state, conn):
+    # persistent link: length-prefixed commands until the laptop hangs up
+    try:
+        n = conn.recv_into(cmd_rx)
+    except OSError as e:
+        print("? CMD link error:", e)
+        n = 0
+    if not n:
+        sel.unregister(conn)
+        conn.close()
+        return
+
+    buf = state["buf"]
+    buf += cmd_rx[:n]
+    while len(buf) >= CMD_HDR.size:
+        end = CMD_HDR.size + CMD_HDR.unpack_from(buf)[0]
+        if len(buf) < end:
+            break
+        payload = bytes(buf[CMD_HDR.size:end])
+        del buf[:end]
+        try:
+            dispatch(payload)
         except Exception as e:
+            # one bad frame must not strand the frames queued behind it
             print("? CMD error:", e)
-        finally:
-            conn.close()
 
 # ================= TTS PLAYBACK =================
-def tts_audio_server():
+tts = {
+    "srv": None, "conn": None, "header": False,
+    "pending": bytearray(), "paused": False, "eof": False
+}
+tts_lock = threading.Lock()
+tts_rx = memoryview(bytearray(4096))     # every TTS recv lands here
+
+def tts_callback(outdata, frames, time_info, status):
+    # PortAudio thread: play what has arrived and pad with silence, so the
+    # always-open stream never underruns between utterances
+    with tts_lock:
+        pending = tts["pending"]
+        n = min(len(outdata), len(pending) - len(pending) % TTS_SAMPLE_BYTES)
+        with memoryview(pending) as src:
+            outdata[:n] = src[:n]
+        del pending[:n]
+    outdata[n:] = TTS_SILENCE[:len(outdata) - n]
+
+def tts_accept(srv):
+    conn, addr = srv.accept()
+    conn.setblocking(False)
+    print("?? TTS stream connected")
+
+    # one stream at a time; the listener is re-armed in tts_finish
+    sel.unregister(srv)
+    tts.update(conn=conn, header=False, paused=False, eof=False)
+    sel.register(conn, selectors.EVENT_READ, tts_readable)
+
+def tts_readable(conn):
+    try:
+        n = conn.recv_into(tts_rx)
+    except OSError:
+        n = 0
+    if not n:
+        sel.unregister(conn)
+        tts["eof"] = True
+        return
+
+    start = 0
+    if not tts["header"]:
+        if tts_rx[:1] != TTS_FMT_I16:
+            print("? Unsupported TTS format")
+            sel.unregister(conn)
+            tts_finish()
+            return
+        tts["header"] = True
+        start = 1
+
+    with tts_lock:
+        tts["pending"] += tts_rx[start:n]
+        full = len(tts["pending"]) >= TTS_MAX_PENDING
+    # stop reading while the speaker catches up so TCP pushes back on the laptop
+    if full:
+        sel.unregister(conn)
+        tts["paused"] = True
+
+def tts_pump():
+    """Resume reading once the speaker drains; close the stream at EOF."""
+    with tts_lock:
+        left = len(tts["pending"])
+
+    if tts["paused"] and left < TTS_MAX_PENDING:
+        tts["paused"] = False
+        sel.register(tts["conn"], selectors.EVENT_READ, tts_readable)
+
+    if tts["eof"] and left < TTS_SAMPLE_BYTES:
+        tts_finish()
+
+def tts_finish():
+    tts["conn"].close()
+    tts.update(conn=None, header=False, paused=False, eof=False)
+    with tts_lock:
+        tts["pending"].clear()
+    sel.register(tts["srv"], selectors.EVENT_READ, tts_accept)
+    print("?? TTS stream closed")
+
+# ================= MAIN LOOP =================
+def keepalive(sock):
+    """Probe idle links so a silently vanished peer is noticed in ~11 s.
+
+    Probes only go out while nothing is in flight, so this covers the
+    receive-only links; a link that keeps sending needs TCP_USER_TIMEOUT.
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "TCP_KEEPIDLE"):     # Linux-only knobs
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, KEEPALIVE_IDLE)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, KEEPALIVE_INTVL)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_CNT)
+
+def listen(port, backlog):
     sock = socket.socket()
-    sock.bind(("0.0.0.0", TTS_PORT))
-    sock.listen(1)
-    print("?? TTS server ready")
+    keepalive(sock)     # inherited by accepted connections
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("0.0.0.0", port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
 
-    while True:
-        conn, addr = sock.accept()
-        print("?? TTS stream connected")
+def main():
+    if esp32:
+        threading.Thread(target=esp_writer, daemon=True).start()
+
+    mic["tx"] = mic_free.get()
+    threading.Thread(target=mic_sender, daemon=True).start()
+
+    sel.register(listen(CMD_PORT, 5), selectors.EVENT_READ, cmd_accept)
+    print("?? Command server listening")
 
-        stream = sd.OutputStream(
+    # a missing speaker only costs playback; motors and mic keep running
+    try:
+        speaker = sd.RawOutputStream(
             samplerate=TTS_SAMPLE_RATE,
             channels=1,
-            dtype="float32",
-            blocksize=BLOCK_SIZE
+            dtype="int16",
+            blocksize=BLOCK_SIZE,
+            callback=tts_callback
         )
-        stream.start()
+        speaker.start()
+    except Exception as e:
+        print("? Speaker unavailable, TTS disabled:", e)
+    else:
+        tts["srv"] = listen(TTS_PORT, 1)
+        sel.register(tts["srv"], selectors.EVENT_READ, tts_accept)
+        print("?? TTS server ready")
 
-        try:
-            while True:
-                data = conn.recv(4096)
-                if not data:
-                    break
-                audio = np.frombuffer(data, dtype=np.float32)
-                stream.write(audio)
-        except Exception:
-            pass
-
-        stream.stop()
-        stream.close()
-        conn.close()
-        print("?? TTS stream closed")
+    while True:
+        if mic["sock"] is None and time.monotonic() >= mic["retry_at"]:
+            mic_connect()
+
+        timeout = TTS_PUMP_SEC if tts["conn"] is not None else 0.5
+        for key, _ in sel.select(timeout):
+            try:
+                key.data(key.fileobj)
+            except Exception as e:
+                print("? Loop error:", e)
+
+        if tts["conn"] is not None:
+            tts_pump()
 
 # ================= START =================
 if __name__ == "__main__":
-    threading.Thread(target=mic_stream, daemon=True).start()
-    threading.Thread(target=tts_audio_server, daemon=True).start()
-    command_server()
+    main()